@@ -1,9 +1,11 @@
 import streamlit as st
-import pandas as pd
-import requests
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
-import io
 import csv
 from countries import COUNTRIES
 import re
@@ -11,129 +13,334 @@ import json
 import base64
 import os
 import zipfile
+import tempfile
+import gc
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from pathlib import Path
+# pandas and requests are imported where they are used so a cold page load doesn't pay for them
+
+# orjson parses the large API responses several times faster; both accept bytes and raise ValueError
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# Concurrent API requests per Generate run; also sizes the HTTP connection pool
+MAX_WORKERS = 24
+
+# (connect, read) timeout in seconds for each API request
+REQUEST_TIMEOUT = (5, 30)
+
+# Cached domain responses kept on the server (ten full 500-domain batches)
+CACHE_MAX_ENTRIES = 5000
+
+# Rows rendered in each on-page preview table
+PREVIEW_ROWS = 100
+
+# Size at which spooled CSV and zip output moves from memory to a temporary file
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+# Time series rows buffered before they are written to Parquet and Feather as one block
+COLUMNAR_BLOCK_ROWS = 64 * 1024
+
+# YYYY-MM with a valid month; no further parsing is needed once this matches
+DATE_FORMAT_RE = re.compile(r'\d{4}-(?:0[1-9]|1[0-2])')
+
+# Static fields in the lead enrichment API response
+METADATA_FIELDS = [
+    'global_rank', 'category_rank', 'company_name', 'site_type', 'site_type_new', 'employee_range',
+    'estimated_revenue_in_usd', 'online_revenue_range', 'headquarters', 'website_category',
+    'website_category_new', 'zip_code'
+]
+
+# Metadata CSV columns
+METADATA_COLUMNS = ['domain'] + METADATA_FIELDS
+
+# Date-keyed metric arrays in the lead enrichment API response
+TIME_SERIES_METRICS = [
+    'visits', 'unique_visitors', 'bounce_rate', 'pages_per_visit', 'average_visit_duration',
+    'mom_growth', 'mobile_desktop_share', 'traffic_sources', 'geography_share'
+]
+
+# Plain numeric metrics, copied straight from the response into their own columns
+BASIC_METRICS = [
+    'visits', 'unique_visitors', 'bounce_rate', 'pages_per_visit', 'average_visit_duration', 'mom_growth'
+]
+
+# Traffic channels reported by the API, as named by traffic_source_column
+TRAFFIC_SOURCE_TYPES = ['direct', 'referrals', 'search', 'social', 'mail', 'display_ads']
+
+# One column per known channel; shares of any other channel are summed into traffic_other
+TRAFFIC_SOURCE_COLUMNS = [f'traffic_{source_type}' for source_type in TRAFFIC_SOURCE_TYPES]
+
+# Time series CSV columns and types; every domain's rows are written against this schema
+TIME_SERIES_SCHEMA = pa.schema(
+    [('domain', pa.string()), ('date', pa.string())]
+    + [(metric, pa.float64()) for metric in BASIC_METRICS + ['desktop_share', 'mobile_share']]
+    + [(column, pa.float64()) for column in TRAFFIC_SOURCE_COLUMNS + ['traffic_other']]
+    + [
+        field
+        for i in range(1, 11)
+        for field in [(f'geo_country_{i}', pa.string()), (f'geo_country_share_{i}', pa.float64())]
+    ]
+)
+TIME_SERIES_COLUMNS = TIME_SERIES_SCHEMA.names
 
 def get_default_dates():
     """Get default start date (4 months ago) and end date (2 months ago)"""
     today = datetime.now()
-    start_date = (today - relativedelta(months=4)).replace(day=1)
-    end_date = (today - relativedelta(months=2)).replace(day=1)
-    return start_date.strftime('%Y-%m'), end_date.strftime('%Y-%m')
+    # Months counted from year 0, as in get_date_range
+    start_index = today.year * 12 + today.month - 1 - 4
+    end_index = start_index + 2
+    return f"{start_index // 12:04d}-{start_index % 12 + 1:02d}", f"{end_index // 12:04d}-{end_index % 12 + 1:02d}"
 
+@lru_cache(maxsize=1024)
 def validate_date_format(date_str):
     """Validate that the date is in YYYY-MM format."""
-    try:
-        if not re.match(r'^\d{4}-(?:0[1-9]|1[0-2])$', date_str):
-            return False
-        datetime.strptime(date_str, '%Y-%m')
-        return True
-    except ValueError:
-        return False
-
-def format_date(date_str):
-    """Format date string to YYYY-MM format."""
-    try:
-        date = datetime.strptime(date_str, '%Y-%m')
-        return date.strftime('%Y-%m')
-    except ValueError:
-        return None
+    return bool(DATE_FORMAT_RE.fullmatch(date_str))
 
+@lru_cache(maxsize=256)
 def get_date_range(start_date, end_date):
-    """Generate a list of dates between start_date and end_date in YYYY-MM format."""
-    dates = []
-    current_date = datetime.strptime(start_date, '%Y-%m')
-    end = datetime.strptime(end_date, '%Y-%m')
-    
-    while current_date <= end:
-        dates.append(current_date.strftime('%Y-%m'))
-        current_date = current_date + relativedelta(months=1)
-    return dates
+    """Generate a tuple of dates between start_date and end_date in YYYY-MM format."""
+    start_year, start_month = map(int, start_date.split('-'))
+    end_year, end_month = map(int, end_date.split('-'))
+    # Months counted from year 0, so consecutive months are consecutive integers
+    start_index = start_year * 12 + start_month - 1
+    end_index = end_year * 12 + end_month - 1
+    return tuple(f"{index // 12:04d}-{index % 12 + 1:02d}" for index in range(start_index, end_index + 1))
 
 def parse_metadata(response_data, domain):
     """Parse the static metadata from the API response."""
-    return {
-        'domain': domain,
-        'global_rank': response_data.get('global_rank', ''),
-        'category_rank': response_data.get('category_rank', ''),
-        'company_name': response_data.get('company_name', ''),
-        'site_type': response_data.get('site_type', ''),
-        'site_type_new': response_data.get('site_type_new', ''),
-        'employee_range': response_data.get('employee_range', ''),
-        'estimated_revenue_in_usd': response_data.get('estimated_revenue_in_usd', ''),
-        'online_revenue_range': response_data.get('online_revenue_range', ''),
-        'headquarters': response_data.get('headquarters', ''),
-        'website_category': response_data.get('website_category', ''),
-        'website_category_new': response_data.get('website_category_new', ''),
-        'zip_code': response_data.get('zip_code', '')
-    }
+    metadata = {'domain': domain}
+    for field in METADATA_FIELDS:
+        metadata[field] = response_data.get(field, '')
+    return metadata
+
+def to_number(value):
+    """Return a metric value as a number for the float64 columns, or None if it isn't one.
+
+    Numeric strings such as '0.5' are converted; '' and any other value become None, so one
+    bad cell is dropped instead of failing the whole domain.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+@lru_cache(maxsize=None)
+def traffic_source_column(source_type):
+    """Map an API source type such as 'Display Ads' to its column name."""
+    return f"traffic_{source_type.lower().replace(' ', '_')}"
+
+def normalize_traffic_sources(traffic_sources):
+    """Key one date's traffic source shares by their column name.
+
+    Channels outside TRAFFIC_SOURCE_TYPES (e.g. 'Paid Search') are summed into traffic_other.
+    """
+    shares = {}
+    for source in traffic_sources:
+        if not isinstance(source, dict) or not source.get('source_type'):
+            continue
+        column = traffic_source_column(source['source_type'])
+        share = to_number(source.get('share'))
+        if column in TRAFFIC_SOURCE_COLUMNS:
+            shares[column] = share
+        elif share is not None:
+            shares['traffic_other'] = shares.get('traffic_other', 0) + share
+    return shares
+
+def normalize_geography_share(geography_share):
+    """Reduce one date's geography share to (country, share) pairs for the top 10 countries."""
+    return [
+        (str(country['country']) if country.get('country') is not None else None, country.get('share'))
+        for country in geography_share[:10]
+        if isinstance(country, dict)
+    ]
+
+# Nested metrics are normalized while indexing so rows can be built without re-parsing them
+METRIC_NORMALIZERS = {
+    'traffic_sources': normalize_traffic_sources,
+    'geography_share': normalize_geography_share
+}
 
-def parse_time_series(response_data, domain, date):
-    """Parse time series metrics for a specific date."""
-    metrics = {
-        'domain': domain,
-        'date': date
-    }
-    
-    def get_metric_value(metric_array, target_date):
+def group_by_date(response_data):
+    """Index every time series metric in the API response by date in a single pass."""
+    values_by_date = defaultdict(dict)
+    for metric in TIME_SERIES_METRICS:
+        metric_array = response_data.get(metric, [])
         if not isinstance(metric_array, list):
-            return ''
+            continue
+        normalize = METRIC_NORMALIZERS.get(metric)
         for entry in metric_array:
-            if isinstance(entry, dict) and entry.get('date') == target_date:
-                return entry.get('value')
-        return ''
-
-    # Basic metrics
-    metrics['visits'] = str(get_metric_value(response_data.get('visits', []), date) or '')
-    metrics['unique_visitors'] = str(get_metric_value(response_data.get('unique_visitors', []), date) or '')
-    metrics['bounce_rate'] = str(get_metric_value(response_data.get('bounce_rate', []), date) or '')
-    metrics['pages_per_visit'] = str(get_metric_value(response_data.get('pages_per_visit', []), date) or '')
-    metrics['average_visit_duration'] = str(get_metric_value(response_data.get('average_visit_duration', []), date) or '')
-    metrics['mom_growth'] = str(get_metric_value(response_data.get('mom_growth', []), date) or '')
-
-    # Mobile/Desktop share
-    mobile_desktop = get_metric_value(response_data.get('mobile_desktop_share', []), date)
-    if isinstance(mobile_desktop, dict):
-        metrics['desktop_share'] = str(mobile_desktop.get('desktop_share', ''))
-        metrics['mobile_share'] = str(mobile_desktop.get('mobile_share', ''))
-    else:
-        metrics['desktop_share'] = ''
-        metrics['mobile_share'] = ''
-
-    # Traffic Sources
-    traffic_sources = get_metric_value(response_data.get('traffic_sources', []), date)
-    if isinstance(traffic_sources, list):
-        for source in traffic_sources:
-            if isinstance(source, dict):
-                source_type = source.get('source_type', '').lower().replace(' ', '_')
-                share = source.get('share', '')
-                if source_type:
-                    metrics[f'traffic_{source_type}'] = str(share) if share != '' else ''
-
-    # Geography Share - Using numbered columns (1-10)
-    geography_share = get_metric_value(response_data.get('geography_share', []), date)
-    if isinstance(geography_share, list):
-        # Initialize all geo columns with empty values
-        for i in range(1, 11):
-            metrics[f'geo_country_{i}'] = ''
-            metrics[f'geo_country_share_{i}'] = ''
-        
-        # Fill in available data
-        for i, country in enumerate(geography_share[:10], 1):  # Only process top 10 countries
-            if isinstance(country, dict):
-                metrics[f'geo_country_{i}'] = str(country.get('country', ''))
-                metrics[f'geo_country_share_{i}'] = str(country.get('share', ''))
-
-    return metrics
-
-def fetch_lead_data(domain, api_key, start_date, end_date, country):
-    """Fetch lead enrichment data for a single domain."""
-    if not all([validate_date_format(start_date), validate_date_format(end_date)]):
-        return {
-            'metadata': [{
-                'domain': domain,
-                'error': 'Invalid date format. Please use YYYY-MM format.'
-            }],
-            'time_series': []
-        }
+            if not isinstance(entry, dict):
+                continue
+            values = values_by_date[entry.get('date')]
+            if metric in values:
+                continue
+            value = entry.get('value')
+            if normalize and isinstance(value, list):
+                value = normalize(value)
+            values[metric] = value
+    return values_by_date
+
+def parse_time_series(values_by_date, domain, dates):
+    """Parse the time series metrics for each date into TIME_SERIES_COLUMNS lists.
+
+    Every column has one value per date, with None for missing or non-numeric data.
+    """
+    row_count = len(dates)
+    columns = {name: [None] * row_count for name in TIME_SERIES_COLUMNS}
+    columns['domain'] = [domain] * row_count
+    columns['date'] = [f"{date}-01" for date in dates]
+
+    for row, date in enumerate(columns['date']):
+        values = values_by_date.get(date)
+        # Nothing reported for this month; the row keeps its preallocated None values
+        if not values:
+            continue
+
+        # Basic metrics
+        for metric in BASIC_METRICS:
+            columns[metric][row] = to_number(values.get(metric))
+
+        # Mobile/Desktop share
+        mobile_desktop = values.get('mobile_desktop_share')
+        if isinstance(mobile_desktop, dict):
+            columns['desktop_share'][row] = to_number(mobile_desktop.get('desktop_share'))
+            columns['mobile_share'][row] = to_number(mobile_desktop.get('mobile_share'))
+
+        # Traffic Sources, already keyed by column name with unknown channels in traffic_other
+        traffic_sources = values.get('traffic_sources')
+        if isinstance(traffic_sources, dict):
+            for column, share in traffic_sources.items():
+                columns[column][row] = share
+
+        # Geography Share - Using numbered columns (1-10)
+        geography_share = values.get('geography_share')
+        if isinstance(geography_share, list):
+            for i, (country, share) in enumerate(geography_share, 1):
+                columns[f'geo_country_{i}'][row] = country
+                columns[f'geo_country_share_{i}'][row] = to_number(share)
+
+    return columns
+
+def completed_in_order(futures):
+    """Yield (index, result, ready) for each future as it completes.
+
+    futures maps each future to its input index. ready lists the results that can now be
+    written without breaking input order; finished results wait until earlier ones are done.
+    """
+    pending = {}
+    next_index = 0
+    for future in as_completed(futures):
+        index = futures[future]
+        result = future.result()
+        pending[index] = result
+        ready = []
+        while next_index in pending:
+            ready.append(pending.pop(next_index))
+            next_index += 1
+        yield index, result, ready
+
+def format_float_column(column):
+    """Render a float column as CSV text in positional notation, with None for nulls.
+
+    Arrow writes 1e10 and above (and 1e-7 and below) in scientific notation, e.g. 8.5123456789e+10
+    for a large visit count; only columns containing such values are reformatted in Python.
+    """
+    text = pc.cast(column, pa.string())
+    if not pc.any(pc.match_substring(text, 'e')).as_py():
+        return text.to_pylist()
+    return [None if value is None else np.format_float_positional(value, trim='-') for value in column.to_pylist()]
+
+def time_series_csv_rows(table):
+    """Return a time series table's rows as lists of CSV fields."""
+    columns = [
+        format_float_column(column) if pa.types.is_floating(column.type) else column.to_pylist()
+        for column in table.columns
+    ]
+    return zip(*columns)
+
+def write_columnar_block(tables, writers):
+    """Write buffered per-domain tables to each writer as one contiguous block and empty the buffer.
+
+    Blocks keep the Parquet row groups and Feather record batches large instead of one per domain.
+    """
+    block = pa.concat_tables(tables).combine_chunks()
+    for writer in writers:
+        writer.write_table(block)
+    tables.clear()
+
+def extract_error_message(response, default):
+    """Return the API's error message from a failed response, falling back to its body or default.
+
+    A 403 with a non-JSON body (e.g. a gateway page) uses default, which explains the likely cause.
+    """
+    try:
+        error_data = json_loads(response.content)
+    except ValueError:
+        if response.status_code == 403 or not response.content:
+            return default
+        return response.text
+    meta = error_data.get('meta') if isinstance(error_data, dict) else None
+    if isinstance(meta, dict):
+        return meta.get('error_message') or default
+    return default
+
+def is_timeout(error):
+    """Return True if a request failed because the API didn't respond in time.
+
+    Once the session's retries run out, urllib3 reports a timeout as the reason of a
+    ConnectionError instead of raising Timeout, so both forms are checked. A refused
+    connection (NewConnectionError) subclasses urllib3's timeout error but is not one.
+    """
+    import requests
+    from urllib3.exceptions import MaxRetryError, NewConnectionError, TimeoutError as Urllib3TimeoutError
+
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    cause = error.args[0] if error.args else None
+    return (
+        isinstance(cause, MaxRetryError)
+        and isinstance(cause.reason, Urllib3TimeoutError)
+        and not isinstance(cause.reason, NewConnectionError)
+    )
+
+@st.cache_resource
+def get_session():
+    """Create a shared HTTP session that pools connections and retries transient failures."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data(ttl=24 * 60 * 60, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def request_lead_data(_session, domain, api_key, start_date, end_date, country, dates):
+    """Request and parse lead enrichment data for a single domain.
+
+    Returns the domain's metadata row and its time series as a TIME_SERIES_SCHEMA table
+    with one row per date.
+    Results are cached per (domain, api_key, start_date, end_date, country) so repeated
+    runs don't spend credits again. Non-200 responses raise HTTPError and are never cached.
+    """
+    import requests
 
     url = f"https://api.similarweb.com/v1/website/{domain}/lead-enrichment/all"
     params = {
@@ -146,198 +353,55 @@ def fetch_lead_data(domain, api_key, start_date, end_date, country):
         "show_verified": "false"
     }
     
-    try:
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            metadata = parse_metadata(data, domain)
-            time_series = []
-            dates = get_date_range(start_date, end_date)
-            for date in dates:
-                formatted_date = f"{date}-01"
-                time_series_entry = parse_time_series(data, domain, formatted_date)
-                time_series.append(time_series_entry)
-            
-            return {
-                'metadata': [metadata],
-                'time_series': time_series
-            }
-        elif response.status_code == 403:
-            error_message = "API authentication failed. Please check your API key and try again."
-            try:
-                error_data = response.json()
-                if error_data.get('meta', {}).get('error_message'):
-                    error_message = error_data['meta']['error_message']
-            except:
-                pass
-            return {
-                'metadata': [{
-                    'domain': domain,
-                    'error': error_message
-                }],
-                'time_series': []
-            }
-        else:
-            error_message = "Unknown error occurred"
-            try:
-                error_data = response.json()
-                if error_data.get('meta', {}).get('error_message'):
-                    error_message = error_data['meta']['error_message']
-            except:
-                error_message = response.text if response.text else f"HTTP Error {response.status_code}"
-            
-            return {
-                'metadata': [{
-                    'domain': domain,
-                    'error': error_message
-                }],
-                'time_series': []
-            }
-    except requests.exceptions.RequestException as e:
-        return {
-            'metadata': [{
-                'domain': domain,
-                'error': f"Network error: {str(e)}"
-            }],
-            'time_series': []
-        }
-    except Exception as e:
-        return {
-            'metadata': [{
-                'domain': domain,
-                'error': f"Error processing data: {str(e)}"
-            }],
-            'time_series': []
-        }
+    response = _session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        raise requests.exceptions.HTTPError(response=response)
+    
+    data = json_loads(response.content)
+    metadata = parse_metadata(data, domain)
+    # Built inside the guarded call so anything unexpected fails this domain, not the whole run
+    time_series = pa.table(parse_time_series(group_by_date(data), domain, dates), schema=TIME_SERIES_SCHEMA)
+    
+    return {
+        'metadata_row': metadata,
+        'time_series_table': time_series
+    }
 
-# Custom styling
-st.set_page_config(
-    page_title="SimilarWeb Lead Enrichment Sample Generator",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+def error_result(domain, error_message):
+    """Build the fetch result for a domain that failed; it has no time series."""
+    return {
+        'metadata_row': {
+            'domain': domain,
+            'error': error_message
+        },
+        'time_series_table': None
+    }
 
-# Custom CSS with SimilarWeb brand colors
-st.markdown("""
-    <style>
-        /* Custom styling */
-        section[data-testid="stSidebar"] {
-            padding: 1rem;
-        }
-        
-        section[data-testid="stSidebar"] .stSubheader {
-            font-size: 1rem !important;
-            font-weight: 600 !important;
-            margin-bottom: 1rem !important;
-        }
-        
-        .stTitle {
-            font-size: 1.5rem !important;
-            font-weight: 500 !important;
-            margin-bottom: 0 !important;
-        }
-        
-        .subtitle {
-            font-size: 0.9rem;
-            margin-bottom: 1rem;
-            opacity: 0.8;
-        }
-        
-        .stButton > button {
-            border: none !important;
-            border-radius: 4px !important;
-            padding: 0.75rem 1.5rem !important;
-            font-weight: 500 !important;
-            transition: all 0.3s ease !important;
-            width: 100% !important;
-        }
-        
-        .stTextInput > div > div > input,
-        .stSelectbox > div > div > div,
-        .stTextArea > div > div > textarea {
-            border-radius: 4px !important;
-        }
-        
-        .stDataFrame {
-            border-radius: 4px !important;
-        }
-        
-        .stTabs [data-baseweb="tab-list"] {
-            gap: 1rem;
-        }
-        
-        .stTabs [data-baseweb="tab"] {
-            border-radius: 4px 4px 0 0;
-        }
-        
-        /* Small text button */
-        .small-text-button {
-            background: none !important;
-            border: none !important;
-            padding: 0 !important;
-            font-size: 0.9rem !important;
-            opacity: 0.9;
-            margin-bottom: 1rem !important;
-        }
-        
-        .small-text-button:hover {
-            text-decoration: underline !important;
-        }
-        
-        /* Code blocks */
-        code {
-            padding: 0.2rem 0.4rem !important;
-            border-radius: 4px !important;
-        }
-
-        /* Theme toggle button container */
-        .theme-toggle-container {
-            position: fixed;
-            top: 0.5rem;
-            right: 1rem;
-            z-index: 1000;
-            display: flex;
-            align-items: center;
-            gap: 0.5rem;
-        }
-        
-        /* Hide default radio button */
-        .theme-toggle-container input[type="radio"] {
-            display: none;
-        }
-        
-        /* Custom radio button style */
-        .theme-toggle-container label {
-            cursor: pointer;
-            padding: 0.3rem 0.6rem;
-            border-radius: 4px;
-            font-size: 0.9rem;
-            transition: all 0.3s ease;
-        }
-        
-        /* Theme icons */
-        .theme-toggle-container .theme-icon {
-            font-size: 1.2rem;
-            margin-right: 0.3rem;
-        }
-    </style>
-""", unsafe_allow_html=True)
+def fetch_lead_data(session, domain, api_key, start_date, end_date, country, dates):
+    """Fetch lead enrichment data for a single domain.
 
-# Initialize theme in session state if not exists
-if 'theme' not in st.session_state:
-    st.session_state.theme = 'light'
+    Dates must already be validated; dates is get_date_range(start_date, end_date).
+    """
+    import requests
 
-# Theme toggle in top right corner
-theme_container = st.container()
-with theme_container:
-    col1, col2, col3 = st.columns([6, 6, 1])
-    with col3:
-        if st.button("🌓" if st.session_state.theme == 'light' else "☀️", key="theme_toggle"):
-            st.session_state.theme = 'dark' if st.session_state.theme == 'light' else 'light'
-            st.rerun()
+    try:
+        return request_lead_data(session, domain, api_key, start_date, end_date, country, dates)
+    except requests.exceptions.HTTPError as e:
+        response = e.response
+        if response.status_code == 403:
+            default_message = "API authentication failed. Please check your API key and try again."
+        else:
+            default_message = f"HTTP Error {response.status_code}"
+        return error_result(domain, extract_error_message(response, default_message))
+    except requests.exceptions.RequestException as e:
+        if is_timeout(e):
+            return error_result(domain, "Request timed out. The API didn't respond in time; please try again.")
+        return error_result(domain, f"Network error: {str(e)}")
+    except Exception as e:
+        return error_result(domain, f"Error processing data: {str(e)}")
 
-# Apply theme
-theme_styles = {
+# Theme colors
+THEME_STYLES = {
     'light': {
         'primary': '#4A90E2',
         'background': '#FFFFFF',
@@ -364,9 +428,15 @@ theme_styles = {
     }
 }
 
-current_theme = theme_styles[st.session_state.theme]
+@st.cache_resource
+def get_theme_css(theme):
+    """Build the full page CSS for a theme once; reruns reuse the cached string.
 
-st.markdown(f"""
+    The theme-independent rules live in style.css; the theme colors are layered on top.
+    """
+    current_theme = THEME_STYLES[theme]
+    base_css = Path(__file__).with_name('style.css').read_text()
+    return f"<style>\n{base_css}</style>\n" + f"""
     <style>
         /* Base theme */
         :root {{
@@ -415,7 +485,7 @@ st.markdown(f"""
         /* Buttons */
         .stButton > button {{
             background-color: var(--accent) !important;
-            color: {'#FFFFFF' if st.session_state.theme == 'light' else '#111827'} !important;
+            color: {'#FFFFFF' if theme == 'light' else '#111827'} !important;
         }}
 
         .stButton > button:hover {{
@@ -516,7 +586,36 @@ st.markdown(f"""
             background: var(--secondary-text);
         }}
     </style>
-""", unsafe_allow_html=True)
+"""
+
+# Custom styling
+st.set_page_config(
+    page_title="SimilarWeb Lead Enrichment Sample Generator",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
+# Initialize theme in session state if not exists
+if 'theme' not in st.session_state:
+    st.session_state.theme = 'light'
+
+def toggle_theme():
+    """Flip the theme before the click's rerun renders, so no second rerun is needed."""
+    st.session_state.theme = 'dark' if st.session_state.theme == 'light' else 'light'
+
+# Theme toggle in top right corner
+theme_container = st.container()
+with theme_container:
+    col1, col2, col3 = st.columns([6, 6, 1])
+    with col3:
+        st.button(
+            "🌓" if st.session_state.theme == 'light' else "☀️",
+            key="theme_toggle",
+            on_click=toggle_theme
+        )
+
+# Apply theme
+st.markdown(get_theme_css(st.session_state.theme), unsafe_allow_html=True)
 
 # Sidebar - API Configuration
 with st.sidebar:
@@ -572,6 +671,13 @@ with st.sidebar:
     # Warning for high usage
     if monthly_credits > 10000:
         st.warning("⚠️ High credit usage detected. Consider optimizing your queries.")
+    
+    # Cached API responses
+    st.markdown("---")
+    st.caption("Results are cached for 24 hours, so re-running the same domains doesn't cost extra credits.")
+    if st.button("🗑️ Clear cache", key="clear_cache"):
+        request_lead_data.clear()
+        st.success("Cache cleared")
 
 # Main content
 st.title("SimilarWeb Lead Enrichment Sample Generator")
@@ -596,40 +702,6 @@ domains_text = st.text_area(
     help="Enter domain names without 'http://', 'https://' or 'www.' prefix. Example: amazon.com"
 )
 
-# Example domains link with better styling
-st.markdown("""
-    <style>
-        .small-text-button {
-            background: none !important;
-            color: var(--sw-accent) !important;
-            border: none !important;
-            padding: 0 !important;
-            font-size: 0.9rem !important;
-            opacity: 0.9;
-            margin-bottom: 1rem !important;
-        }
-        .small-text-button:hover {
-            color: var(--sw-secondary) !important;
-            text-decoration: underline !important;
-        }
-        .small-text-button > div {
-            display: inline-flex !important;
-            gap: 0.3rem !important;
-        }
-        
-        /* Add progress bar styling */
-        .stProgress > div > div > div > div {
-            background-color: var(--sw-accent) !important;
-        }
-        
-        /* Style info messages */
-        .stAlert {
-            background-color: var(--sw-light) !important;
-            border-color: var(--sw-accent) !important;
-        }
-    </style>
-""", unsafe_allow_html=True)
-
 # Example domains button styled as text
 if st.button("📋 Use example domains", type="secondary", use_container_width=False, key="example_domains"):
     st.session_state.domains_text = """amazon.com
@@ -645,7 +717,8 @@ if st.button("Generate CSV", type="primary"):
         st.error("⚠️ Please enter at least one domain")
     elif not validate_date_format(start_date) or not validate_date_format(end_date):
         st.error("⚠️ Please enter valid dates in YYYY-MM format")
-    elif datetime.strptime(end_date, '%Y-%m') < datetime.strptime(start_date, '%Y-%m'):
+    # Validated YYYY-MM strings sort chronologically, so they can be compared directly
+    elif end_date < start_date:
         st.error("⚠️ End date must be after start date")
     else:
         # Process domains from text area
@@ -657,48 +730,119 @@ if st.button("Generate CSV", type="primary"):
             st.error("⚠️ No valid domains found")
         else:
             with st.spinner('🔄 Processing domains... This may take a few minutes.'):
-                all_metadata = []
-                all_time_series = []
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 
                 has_errors = False
-                for i, domain in enumerate(domains):
-                    status_text.text(f"Processing {domain}...")
-                    result = fetch_lead_data(domain, api_key, start_date, end_date, country_code)
+                session = get_session()
+                dates = get_date_range(start_date, end_date)
+                
+                # Rows are written to spooled files as results arrive; only the previews stay in memory
+                metadata_preview = []
+                time_series_preview = []
+                metadata_rows = 0
+                time_series_rows = 0
+                with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+', newline='', encoding='utf-8') as metadata_file, \
+                        tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+', newline='', encoding='utf-8') as time_series_file, \
+                        tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as time_series_parquet_file, \
+                        tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as time_series_feather_file:
+                    metadata_writer = csv.DictWriter(metadata_file, fieldnames=METADATA_COLUMNS, lineterminator='\n')
+                    metadata_writer.writeheader()
+                    time_series_writer = csv.writer(time_series_file, lineterminator='\n')
+                    time_series_writer.writerow(TIME_SERIES_COLUMNS)
+                    # Typed columnar formats load much faster than CSV in pandas, Spark and DuckDB
+                    columnar_writers = [
+                        pq.ParquetWriter(time_series_parquet_file, TIME_SERIES_SCHEMA, compression='snappy'),
+                        # Feather is an Arrow IPC file; lz4 matches pyarrow.feather.write_feather's default
+                        pa.ipc.new_file(
+                            time_series_feather_file,
+                            TIME_SERIES_SCHEMA,
+                            options=pa.ipc.IpcWriteOptions(compression='lz4')
+                        )
+                    ]
+                    columnar_block = []
+                    columnar_block_rows = 0
                     
-                    # Check for API errors
-                    if result['metadata'][0].get('error'):
-                        has_errors = True
-                        st.error(f"❌ Error processing {domain}: {result['metadata'][0]['error']}")
-                        continue
+                    # Workers share this run's script context so cached calls don't warn about a missing one
+                    script_run_ctx = get_script_run_ctx()
+                    with ThreadPoolExecutor(
+                        max_workers=MAX_WORKERS,
+                        initializer=lambda: add_script_run_ctx(threading.current_thread(), script_run_ctx)
+                    ) as executor:
+                        futures = {
+                            executor.submit(fetch_lead_data, session, domain, api_key, start_date, end_date, country_code, dates): i
+                            for i, domain in enumerate(domains)
+                        }
+                        for completed, (i, result, ready) in enumerate(completed_in_order(futures), 1):
+                            # Check for API errors
+                            if result['metadata_row'].get('error'):
+                                has_errors = True
+                                st.error(f"❌ Error processing {domains[i]}: {result['metadata_row']['error']}")
+                            
+                            # Keep the output in the order the domains were entered
+                            for ready_result in ready:
+                                if ready_result['metadata_row'].get('error'):
+                                    continue
+                                time_series_table = ready_result['time_series_table']
+                                metadata_writer.writerow(ready_result['metadata_row'])
+                                time_series_writer.writerows(time_series_csv_rows(time_series_table))
+                                columnar_block.append(time_series_table)
+                                columnar_block_rows += time_series_table.num_rows
+                                if columnar_block_rows >= COLUMNAR_BLOCK_ROWS:
+                                    write_columnar_block(columnar_block, columnar_writers)
+                                    columnar_block_rows = 0
+                                if metadata_rows < PREVIEW_ROWS:
+                                    metadata_preview.append(ready_result['metadata_row'])
+                                if time_series_rows < PREVIEW_ROWS:
+                                    time_series_preview.append(time_series_table)
+                                metadata_rows += 1
+                                time_series_rows += time_series_table.num_rows
+                            
+                            status_text.text(f"Processed {completed} of {len(domains)} domains...")
+                            progress_bar.progress(completed / len(domains))
                     
-                    all_metadata.extend(result['metadata'])
-                    all_time_series.extend(result['time_series'])
-                    progress_bar.progress((i + 1) / len(domains))
+                    # Serialize each file once; the same data feeds every download below
+                    if columnar_block:
+                        write_columnar_block(columnar_block, columnar_writers)
+                    for writer in columnar_writers:
+                        writer.close()
+                    metadata_file.seek(0)
+                    # Encoded once here so the download and the zip share the same bytes
+                    metadata_csv = metadata_file.read().encode('utf-8')
+                    time_series_file.seek(0)
+                    time_series_csv = time_series_file.read().encode('utf-8')
+                    time_series_parquet_file.seek(0)
+                    time_series_parquet = time_series_parquet_file.read()
+                    time_series_feather_file.seek(0)
+                    time_series_feather = time_series_feather_file.read()
                 
                 if has_errors:
                     status_text.text("⚠️ Processing complete with errors. Check the error messages above.")
                 else:
                     status_text.text("✅ Processing complete!")
                 
-                # Only create DataFrames if we have data
-                if all_metadata or all_time_series:
-                    # Create DataFrames
-                    df_metadata = pd.DataFrame(all_metadata)
-                    df_time_series = pd.DataFrame(all_time_series)
-                    
-                    # Ensure domain and date are first columns in time series
-                    if not df_time_series.empty:
-                        cols = ['domain', 'date'] + [col for col in df_time_series.columns if col not in ['domain', 'date']]
-                        df_time_series = df_time_series[cols]
+                # Only build output if we have data
+                if metadata_rows:
+                    import pandas as pd
+
+                    # Only the first rows are rendered; the full data is in the downloads
+                    df_metadata = pd.DataFrame(metadata_preview[:PREVIEW_ROWS], columns=METADATA_COLUMNS)
+                    df_time_series = (
+                        pa.concat_tables(time_series_preview or [TIME_SERIES_SCHEMA.empty_table()])
+                        .slice(0, PREVIEW_ROWS)
+                        .to_pandas(types_mapper=pd.ArrowDtype)
+                    )
                     
                     # Show previews with better styling
                     st.subheader("📊 Metadata Preview:")
                     st.dataframe(df_metadata, use_container_width=True)
+                    if metadata_rows > PREVIEW_ROWS:
+                        st.caption(f"Showing {PREVIEW_ROWS} of {metadata_rows:,} rows — full data in download")
                     
                     st.subheader("📈 Time Series Preview:")
                     st.dataframe(df_time_series, use_container_width=True)
+                    if time_series_rows > PREVIEW_ROWS:
+                        st.caption(f"Showing {PREVIEW_ROWS} of {time_series_rows:,} rows — full data in download")
                     
                     # Download section with better organization
                     st.subheader("📥 Download Options")
@@ -706,42 +850,61 @@ if st.button("Generate CSV", type="primary"):
                     col1, col2, col3 = st.columns([1, 1, 1])
                     
                     with col1:
-                        csv_buffer_metadata = io.StringIO()
-                        df_metadata.to_csv(csv_buffer_metadata, index=False)
                         st.download_button(
                             label="⬇️ Download Metadata CSV",
-                            data=csv_buffer_metadata.getvalue(),
+                            data=metadata_csv,
                             file_name="similarweb_metadata.csv",
                             mime="text/csv",
                             help="Download the metadata information as a CSV file"
                         )
                     
                     with col2:
-                        csv_buffer_time_series = io.StringIO()
-                        df_time_series.to_csv(csv_buffer_time_series, index=False)
                         st.download_button(
                             label="⬇️ Download Time Series CSV",
-                            data=csv_buffer_time_series.getvalue(),
+                            data=time_series_csv,
                             file_name="similarweb_time_series.csv",
                             mime="text/csv",
                             help="Download the time series data as a CSV file"
                         )
                     
                     with col3:
-                        zip_buffer = io.BytesIO()
-                        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                            metadata_buffer = io.StringIO()
-                            df_metadata.to_csv(metadata_buffer, index=False)
-                            zip_file.writestr('similarweb_metadata.csv', metadata_buffer.getvalue())
-                            
-                            time_series_buffer = io.StringIO()
-                            df_time_series.to_csv(time_series_buffer, index=False)
-                            zip_file.writestr('similarweb_time_series.csv', time_series_buffer.getvalue())
+                        # Small archives stay in memory; large ones spill to disk while being built
+                        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as zip_buffer:
+                            # Fastest deflate level: CSV text still compresses well and level 6 costs far more CPU
+                            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zip_file:
+                                zip_file.writestr('similarweb_metadata.csv', metadata_csv)
+                                zip_file.writestr('similarweb_time_series.csv', time_series_csv)
+                            zip_buffer.seek(0)
+                            zip_data = zip_buffer.read()
                         
                         st.download_button(
                             label="⬇️ Download All CSVs",
-                            data=zip_buffer.getvalue(),
+                            data=zip_data,
                             file_name="similarweb_data.zip",
                             mime="application/zip",
                             help="Download both Metadata and Time Series CSVs in a zip file"
-                        ) 
\ No newline at end of file
+                        )
+                    
+                    col4, col5, _ = st.columns([1, 1, 1])
+                    
+                    with col4:
+                        st.download_button(
+                            label="⬇️ Download Time Series Parquet",
+                            data=time_series_parquet,
+                            file_name="similarweb_time_series.parquet",
+                            mime="application/octet-stream",
+                            help="Download the time series data as a snappy-compressed Parquet file"
+                        )
+                    
+                    with col5:
+                        st.download_button(
+                            label="⬇️ Download Time Series Feather",
+                            data=time_series_feather,
+                            file_name="similarweb_time_series.feather",
+                            mime="application/octet-stream",
+                            help="Download the time series data as an lz4-compressed Feather file"
+                        )
+                    
+                    # Release the batch before the next rerun instead of waiting for the collector
+                    del metadata_preview, time_series_preview, metadata_csv, time_series_csv, time_series_feather, time_series_parquet, df_metadata, df_time_series
+                    gc.collect()